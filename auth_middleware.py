@@ -1,35 +1,79 @@
 from fastapi import Request, HTTPException, Depends
 from fastapi.responses import RedirectResponse
-from firebase_config import FirebaseAuth
-from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from firebase_config import FirebaseAuth, user_cache
+from cache import MISSING
+from profiling import profiled
+from typing import Dict, Optional, Tuple
+import asyncio
 import json
 
+# In-flight user document loads on this event loop, keyed by (uid, cache write version)
+_user_data_loads: Dict[Tuple[str, int], asyncio.Future] = {}
+
 def get_current_user(request: Request) -> Optional[dict]:
-    """Get current user from session or token"""
+    """Get current user from session or token (memoized on request.state)"""
+    if hasattr(request.state, 'user'):
+        return request.state.user
+    request.state.user = _resolve_user(request)
+    return request.state.user
+
+def _resolve_user(request: Request) -> Optional[dict]:
     # Check for user in session first
     user = request.session.get('user')
     if user:
         return user
 
-    # Check for Firebase token in headers
+    # Stateless API auth: Bearer clients never read or write the session
     auth_header = request.headers.get('Authorization')
     if auth_header and auth_header.startswith('Bearer '):
         token = auth_header.split(' ')[1]
-        user_info = FirebaseAuth.verify_token(token)
+        # Internal access token minted by /auth/token (local HMAC check)
+        user_info = FirebaseAuth.verify_access_token(token)
         if user_info:
-            # Store user in session
-            request.session['user'] = user_info
             return user_info
+        # Fall back to a raw Firebase ID token
+        return FirebaseAuth.verify_token(token)
 
     return None
 
-def require_auth(request: Request):
+async def optional_auth(request: Request) -> Optional[dict]:
+    """Dependency for optional authentication"""
+    if hasattr(request.state, 'user') or 'Authorization' not in request.headers:
+        # Memoized or session-only lookup: no I/O involved
+        return get_current_user(request)
+    # Token verification may go to Firebase, keep it off the event loop
+    return await run_in_threadpool(profiled(get_current_user), request)
+
+async def require_auth(user: Optional[dict] = Depends(optional_auth)) -> dict:
     """Dependency to require authentication"""
-    user = get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="Authentication required")
     return user
 
-def optional_auth(request: Request):
-    """Dependency for optional authentication"""
-    return get_current_user(request)
+async def optional_user_data(request: Request, user: Optional[dict] = Depends(optional_auth)) -> Optional[dict]:
+    """Dependency that loads the current user's Firestore document, if logged in
+
+    Runs after optional_auth (it needs the uid), not alongside it; the read
+    happens in the threadpool so the event loop keeps serving other requests.
+    """
+    if not user:
+        return None
+    if not hasattr(request.state, 'user_data'):
+        request.state.user_data = await load_user_data(user['uid'])
+    return request.state.user_data
+
+async def load_user_data(uid: str) -> Optional[dict]:
+    """Load a user document, sharing one threadpool call among concurrent requests"""
+    user_data = user_cache.get(uid)
+    if user_data is not MISSING:
+        return user_data
+    # Waiters await a future instead of each holding a threadpool thread
+    key = (uid, user_cache.write_version(uid))
+    load = _user_data_loads.get(key)
+    if load is None:
+        load = asyncio.ensure_future(run_in_threadpool(profiled(FirebaseAuth.get_user_by_uid), uid))
+        _user_data_loads[key] = load
+        load.add_done_callback(lambda _: _user_data_loads.pop(key, None))
+    # Shielded so one client going away does not cancel the load for the others
+    return await asyncio.shield(load)
@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Returned by TTLCache.get on a miss, so that None can be cached as a value
+MISSING = object()
+
+class TTLCache:
+    """Small thread-safe in-memory cache with per-entry expiry
+
+    Fills can be guarded against concurrent writes: take version() before
+    reading the source, pass it to set() as since, and the fill is dropped if
+    the key was deleted in the meantime.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        # One counter for the whole cache, bumped by every delete
+        self._version = 0
+        # Version of each key's most recent delete, oldest first and bounded by max_size
+        self._deleted_at: Dict[str, int] = {}
+        # Highest version dropped from _deleted_at; fills older than this are refused
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Return the cached value, or MISSING if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            return value
+
+    def version(self) -> int:
+        """Token to take before reading the source of a fill"""
+        with self._lock:
+            return self._version
+
+    def write_version(self, key: str) -> int:
+        """Value that changes whenever key is deleted (for keying in-flight reads)"""
+        with self._lock:
+            return self._deleted_at.get(key, self._floor)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, since: Optional[int] = None) -> bool:
+        """Cache a value for ttl seconds (defaults to the cache's ttl)
+
+        With since, the value is only stored if key has not been deleted
+        after that version() was taken; returns whether it was stored.
+        """
+        with self._lock:
+            if since is not None and (since < self._floor or self._deleted_at.get(key, 0) > since):
+                return False
+            self._entries.pop(key, None)
+            if self._entries and len(self._entries) >= self.max_size:
+                # Evict the oldest insertion
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            return True
+
+    def delete(self, key: str):
+        """Drop a cached value and invalidate fills that started before now"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._version += 1
+            self._deleted_at.pop(key, None)
+            self._deleted_at[key] = self._version
+            if len(self._deleted_at) > self.max_size:
+                oldest = next(iter(self._deleted_at))
+                self._floor = max(self._floor, self._deleted_at.pop(oldest))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one in-flight call"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(*args), or wait for and share the result of a call already running for key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
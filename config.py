@@ -22,13 +22,51 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", None)
     SESSION_MAX_AGE = 3600  # 1 hour
 
+    # API Access Token Configuration (stateless Bearer auth)
+    ACCESS_TOKEN_ALGORITHM = "HS256"
+    ACCESS_TOKEN_MAX_AGE = int(os.getenv("ACCESS_TOKEN_MAX_AGE", "900"))  # 15 minutes
+
     # App Configuration
     APP_TITLE = "Firebase Auth Demo"
     APP_VERSION = "1.0.0"
     DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 
+    # Live Update Configuration (server-sent events, per worker)
+    SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", "1000"))
+    SSE_QUEUE_SIZE = 16
+    SSE_KEEPALIVE_SECONDS = 15
+
+    # Background Write Queue Configuration (per worker)
+    WRITE_QUEUE_MAX_SIZE = int(os.getenv("WRITE_QUEUE_MAX_SIZE", "1000"))
+    WRITE_QUEUE_WORKERS = int(os.getenv("WRITE_QUEUE_WORKERS", "4"))
+    WRITE_QUEUE_MAX_RETRIES = 3
+    WRITE_QUEUE_RETRY_DELAY = 0.5  # seconds, doubled on each retry
+    WRITE_QUEUE_PUT_TIMEOUT = 1.0  # seconds before a caller writes inline
+    WRITE_QUEUE_DRAIN_TIMEOUT = 10.0  # seconds
+    WRITE_QUEUE_DEAD_LETTER_PATH = os.getenv("WRITE_QUEUE_DEAD_LETTER_PATH", "dead_letter_writes.jsonl")
+
+    # User Document Cache Configuration (per worker)
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))  # seconds
+    USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+    USER_NEGATIVE_CACHE_TTL = float(os.getenv("USER_NEGATIVE_CACHE_TTL", "5"))  # seconds, for missing documents
+
+    # Startup Warm-up Configuration
+    WARMUP_PRELOAD_USERS = int(os.getenv("WARMUP_PRELOAD_USERS", "500"))
+    WARMUP_CACHE_TTL = float(os.getenv("WARMUP_CACHE_TTL", "120"))  # seconds, for preloaded documents
+
+    # Profiling Configuration (admin only, off by default)
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+    PROFILING_ADMIN_UIDS = [uid.strip() for uid in os.getenv("PROFILING_ADMIN_UIDS", "").split(",") if uid.strip()]
+    PROFILING_HEADER = "X-Profile-Request"
+    PROFILING_MAX_SECONDS = 60
+    PROFILING_SAMPLE_INTERVAL = 0.005  # seconds
+    PROFILING_OUTPUT_DIR = os.getenv("PROFILING_OUTPUT_DIR", "profiles")
+    PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))  # request profiles kept on disk
+
     # Database Configuration
     FIRESTORE_COLLECTION_USERS = "users"
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")  # "firestore" or "sqlite"
+    SQLITE_DATABASE_PATH = os.getenv("SQLITE_DATABASE_PATH", "local_store.db")
 
     @classmethod
     def get_firebase_config(cls) -> Dict[str, Any]:
@@ -42,3 +80,20 @@ class Config:
             "secret_key": cls.SECRET_KEY,
             "max_age": cls.SESSION_MAX_AGE
         }
+
+    @classmethod
+    def get_access_token_config(cls) -> Dict[str, Any]:
+        """Get API access token configuration"""
+        return {
+            "secret_key": cls.SECRET_KEY,
+            "algorithm": cls.ACCESS_TOKEN_ALGORITHM,
+            "max_age": cls.ACCESS_TOKEN_MAX_AGE
+        }
+
+    @classmethod
+    def get_storage_config(cls) -> Dict[str, Any]:
+        """Get storage backend configuration"""
+        return {
+            "backend": cls.STORAGE_BACKEND.lower(),
+            "sqlite_path": cls.SQLITE_DATABASE_PATH
+        }
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import threading
+from config import Config
+from typing import Dict, Optional, Set
+
+class UserEventBroker:
+    """Fan out user document changes to open pages of this worker"""
+
+    def __init__(self, max_connections: int, queue_size: int):
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._connection_count = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, uid: str) -> Optional[asyncio.Queue]:
+        """Register a listener for a user, or None if the worker is at capacity"""
+        with self._lock:
+            if self._connection_count >= self.max_connections:
+                return None
+            self._loop = asyncio.get_running_loop()
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._subscribers.setdefault(uid, set()).add(queue)
+            self._connection_count += 1
+            return queue
+
+    def unsubscribe(self, uid: str, queue: asyncio.Queue):
+        """Remove a listener registered with subscribe"""
+        with self._lock:
+            queues = self._subscribers.get(uid)
+            if not queues or queue not in queues:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[uid]
+            self._connection_count -= 1
+
+    def publish(self, uid: str, patch: dict):
+        """Push a patch of changed fields to every listener of a user (thread-safe)"""
+        if not patch or uid not in self._subscribers or self._loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._deliver(uid, patch)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, uid, patch)
+
+    def _deliver(self, uid: str, patch: dict):
+        with self._lock:
+            queues = list(self._subscribers.get(uid, ()))
+        for queue in queues:
+            if queue.full():
+                # Slow client: drop the oldest patch rather than grow without bound
+                queue.get_nowait()
+            queue.put_nowait(patch)
+
+def json_patch(user_data: dict) -> dict:
+    """Keep only the JSON-serializable fields of a user write"""
+    patch = {}
+    for key, value in user_data.items():
+        try:
+            json.dumps(value)
+        except TypeError:
+            # e.g. Firestore SERVER_TIMESTAMP sentinels
+            continue
+        patch[key] = value
+    return patch
+
+def format_sse(data: dict, event: str = "patch") -> str:
+    """Encode a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+broker = UserEventBroker(
+    max_connections=Config.SSE_MAX_CONNECTIONS,
+    queue_size=Config.SSE_QUEUE_SIZE
+)
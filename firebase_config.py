@@ -1,6 +1,12 @@
 import firebase_admin
-from firebase_admin import credentials, auth, firestore
+from firebase_admin import credentials, auth
+from jose import jwt, JWTError
+from config import Config
+from events import broker, json_patch
+from storage import get_store
+from cache import TTLCache, SingleFlight, MISSING
 import os
+import time
 from typing import Optional
 
 # Initialize Firebase Admin SDK
@@ -18,8 +24,11 @@ except Exception as e:
     print(f"Firebase initialization error: {e}")
     print("Please ensure you have proper Firebase credentials set up")
 
-# Initialize Firestore
-db = firestore.client()
+# Recently read user documents (None for missing ones), invalidated on write.
+# Per worker: a write handled by another worker is only seen once the entry expires.
+user_cache = TTLCache(ttl=Config.USER_CACHE_TTL, max_size=Config.USER_CACHE_MAX_SIZE)
+# In-flight user document reads, shared by concurrent lookups of the same uid and write version
+user_reads = SingleFlight()
 
 class FirebaseAuth:
     @staticmethod
@@ -33,22 +42,108 @@ class FirebaseAuth:
             return None
 
     @staticmethod
-    def get_user_by_uid(uid: str) -> Optional[dict]:
-        """Get user data from Firestore"""
+    def create_access_token(user_info: dict) -> dict:
+        """Mint a short-lived signed API access token from verified user info"""
+        token_config = Config.get_access_token_config()
+        now = int(time.time())
+        claims = {
+            'sub': user_info['uid'],
+            'uid': user_info['uid'],
+            'email': user_info.get('email'),
+            'name': user_info.get('name', ''),
+            'iat': now,
+            'exp': now + token_config['max_age']
+        }
+        access_token = jwt.encode(claims, token_config['secret_key'], algorithm=token_config['algorithm'])
+        return {
+            'access_token': access_token,
+            'token_type': 'bearer',
+            'expires_in': token_config['max_age']
+        }
+
+    @staticmethod
+    def verify_access_token(access_token: str) -> Optional[dict]:
+        """Verify an API access token locally (HMAC only, no Firebase round trip)"""
+        token_config = Config.get_access_token_config()
         try:
-            user_doc = db.collection('users').document(uid).get()
-            if user_doc.exists:
-                return user_doc.to_dict()
+            claims = jwt.decode(access_token, token_config['secret_key'], algorithms=[token_config['algorithm']])
+        except JWTError:
             return None
+        return {
+            'uid': claims['uid'],
+            'email': claims.get('email'),
+            'name': claims.get('name', '')
+        }
+
+    @staticmethod
+    def prefetch_signing_keys() -> bool:
+        """Warm the SDK's HTTP cache of Google's ID token signing certificates"""
+        try:
+            # Best effort: relies on firebase_admin internals, which may change
+            verifier = auth._get_client(firebase_admin.get_app())._token_verifier
+            verifier.request(verifier.id_token_verifier.cert_url, method='GET')
+            return True
+        except Exception as e:
+            print(f"Error prefetching signing keys: {e}")
+            return False
+
+    @staticmethod
+    def get_user_by_uid(uid: str) -> Optional[dict]:
+        """Get user data from the cache or the configured store"""
+        user_data = user_cache.get(uid)
+        if user_data is not MISSING:
+            return user_data
+        # Keyed by write version: lookups made after a write never join a read that predates it
+        return user_reads.do((uid, user_cache.write_version(uid)), FirebaseAuth._load_user, uid)
+
+    @staticmethod
+    def _load_user(uid: str) -> Optional[dict]:
+        # A read that finished just before this one started may already have filled the cache
+        user_data = user_cache.get(uid)
+        if user_data is not MISSING:
+            return user_data
+        version = user_cache.version()
+        try:
+            user_data = get_store().get(Config.FIRESTORE_COLLECTION_USERS, uid)
         except Exception as e:
             print(f"Error getting user data: {e}")
             return None
+        # A write landing during the read invalidates the version and the fill is dropped
+        if user_data is None:
+            # Briefly remember missing documents so page views don't keep re-querying
+            user_cache.set(uid, None, ttl=Config.USER_NEGATIVE_CACHE_TTL, since=version)
+        else:
+            user_cache.set(uid, user_data, since=version)
+        return user_data
+
+    @staticmethod
+    def preload_recent_users(limit: int) -> int:
+        """Cache the most recently active user documents; returns how many were loaded"""
+        if limit <= 0:
+            return 0
+        version = user_cache.version()
+        try:
+            users = get_store().stream(
+                Config.FIRESTORE_COLLECTION_USERS, order_by='last_login', descending=True, limit=limit
+            )
+            count = 0
+            for user_data in users:
+                uid = user_data.get('uid')
+                # Documents written after the query started are left for normal reads
+                if uid and user_cache.set(uid, user_data, ttl=Config.WARMUP_CACHE_TTL, since=version):
+                    count += 1
+            return count
+        except Exception as e:
+            print(f"Error preloading users: {e}")
+            return 0
 
     @staticmethod
     def create_or_update_user(uid: str, user_data: dict):
-        """Create or update user data in Firestore"""
+        """Create or update user data in the configured store"""
         try:
-            db.collection('users').document(uid).set(user_data, merge=True)
+            get_store().set(Config.FIRESTORE_COLLECTION_USERS, uid, user_data, merge=True)
+            user_cache.delete(uid)
+            broker.publish(uid, json_patch(user_data))
             return True
         except Exception as e:
             print(f"Error creating/updating user: {e}")
@@ -1,20 +1,54 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from auth_middleware import get_current_user, require_auth, optional_auth
+from auth_middleware import require_auth, optional_auth, optional_user_data
+from typing import Optional
 from firebase_config import FirebaseAuth
-from firebase_admin import firestore
+from storage import SERVER_TIMESTAMP
 from config import Config
+from events import broker, format_sse
+from task_queue import write_queue
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import json
 import os
+import time
 from dotenv import load_dotenv
 from starlette.middleware.sessions import SessionMiddleware
 
 # Load environment variables
 load_dotenv()
 
+# Pre-rendered pages that do not depend on the visitor
+PAGE_CACHE = {}
+
+async def warm_up(app: FastAPI):
+    """Preload hot data so the first requests after a deploy are not cold"""
+    started = time.perf_counter()
+    preloaded, _ = await asyncio.gather(
+        run_in_threadpool(FirebaseAuth.preload_recent_users, Config.WARMUP_PRELOAD_USERS),
+        run_in_threadpool(FirebaseAuth.prefetch_signing_keys)
+    )
+    PAGE_CACHE['public'] = render_public_page(None)
+    app.state.warmup_seconds = round(time.perf_counter() - started, 3)
+    app.state.ready = True
+    print(f"Warm-up completed in {app.state.warmup_seconds}s ({preloaded} users preloaded)")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve liveness right away; readiness flips once warm-up is done
+    app.state.ready = False
+    app.state.warmup_seconds = None
+    await write_queue.start()
+    warmup_task = asyncio.create_task(warm_up(app))
+    yield
+    warmup_task.cancel()
+    # Flush queued Firestore writes before the worker exits
+    await write_queue.drain(timeout=Config.WRITE_QUEUE_DRAIN_TIMEOUT)
+
 # Initialize FastAPI app
-app = FastAPI(title=Config.APP_TITLE, version=Config.APP_VERSION)
+app = FastAPI(title=Config.APP_TITLE, version=Config.APP_VERSION, lifespan=lifespan)
 
 # Add session middleware
 session_config = Config.get_session_config()
@@ -24,6 +58,12 @@ app.add_middleware(
     max_age=session_config["max_age"]
 )
 
+# Per-request profiling is only wired in when enabled, so it costs nothing otherwise.
+# Added after the session middleware so that it wraps it and sees cookie signing.
+if Config.PROFILING_ENABLED:
+    from profiling import RequestProfilerMiddleware
+    app.add_middleware(RequestProfilerMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -32,9 +72,15 @@ FIREBASE_CONFIG = Config.get_firebase_config()
 
 # 1. Public Page
 @app.get("/", response_class=HTMLResponse)
-async def public_page(request: Request):
-    user = get_current_user(request)
-
+async def public_page(request: Request, user: Optional[dict] = Depends(optional_auth)):
+    if user:
+        return HTMLResponse(content=render_public_page(user))
+    if 'public' not in PAGE_CACHE:
+        PAGE_CACHE['public'] = render_public_page(None)
+    return HTMLResponse(content=PAGE_CACHE['public'])
+
+def render_public_page(user: Optional[dict]) -> str:
+    """Build the public page HTML for a visitor (None when logged out)"""
     html_content = f"""
     <!DOCTYPE html>
     <html lang="en">
@@ -212,7 +258,7 @@ async def public_page(request: Request):
     </html>
     """
 
-    return HTMLResponse(content=html_content)
+    return html_content
 
 # 2. Authentication Endpoints
 @app.post("/auth/login")
@@ -230,14 +276,14 @@ async def login(request: Request):
     # Store user in session
     request.session['user'] = user_info
 
-    # Create or update user in Firestore
+    # Create or update user in Firestore once the response has been sent
     user_data = {
         'email': user_info.get('email'),
         'name': user_info.get('name', ''),
-        'last_login': firestore.SERVER_TIMESTAMP,
+        'last_login': SERVER_TIMESTAMP,
         'uid': user_info.get('uid')
     }
-    FirebaseAuth.create_or_update_user(user_info['uid'], user_data)
+    await write_queue.submit(user_info['uid'], user_data)
 
     return {"message": "Login successful"}
 
@@ -256,22 +302,37 @@ async def signup(request: Request):
     # Store user in session
     request.session['user'] = user_info
 
-    # Create user in Firestore
+    # Create user in Firestore once the response has been sent
     user_data = {
         'email': user_info.get('email'),
         'name': user_info.get('name', ''),
-        'created_at': firestore.SERVER_TIMESTAMP,
-        'last_login': firestore.SERVER_TIMESTAMP,
+        'created_at': SERVER_TIMESTAMP,
+        'last_login': SERVER_TIMESTAMP,
         'uid': user_info.get('uid'),
         'preferences': {
             'theme': 'light',
             'notifications': True
         }
     }
-    FirebaseAuth.create_or_update_user(user_info['uid'], user_data)
+    await write_queue.submit(user_info['uid'], user_data)
 
     return {"message": "Signup successful"}
 
+@app.post("/auth/token")
+async def issue_access_token(request: Request):
+    """Exchange a Firebase ID token for a short-lived API access token"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    token = auth_header.split(' ')[1]
+    user_info = FirebaseAuth.verify_token(token)
+
+    if not user_info:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    return FirebaseAuth.create_access_token(user_info)
+
 @app.post("/auth/logout")
 async def logout(request: Request):
     request.session.clear()
@@ -279,14 +340,14 @@ async def logout(request: Request):
 
 # 3. Private Pages
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request):
-    user = get_current_user(request)
+async def dashboard(
+    request: Request,
+    user: Optional[dict] = Depends(optional_auth),
+    user_data: Optional[dict] = Depends(optional_user_data)
+):
     if not user:
         return RedirectResponse(url="/")
 
-    # Get user data from Firestore
-    user_data = FirebaseAuth.get_user_by_uid(user['uid'])
-
     html_content = f"""
     <!DOCTYPE html>
     <html lang="en">
@@ -341,7 +402,7 @@ async def dashboard(request: Request):
                 </div>
                 <div class="stat-card">
                     <h3>⚙️ Preferences</h3>
-                    <p style="font-size: 1.2em; color: #ffc107;">{len(user_data.get('preferences', {})) if user_data else 0} settings</p>
+                    <p id="preferencesCount" style="font-size: 1.2em; color: #ffc107;">{len(user_data.get('preferences', {})) if user_data else 0} settings</p>
                 </div>
             </div>
 
@@ -360,21 +421,33 @@ async def dashboard(request: Request):
                 }}
             }}
 
+            function applyPatch(patch) {{
+                if (patch.preferences) {{
+                    document.getElementById('preferencesCount').textContent = Object.keys(patch.preferences).length + ' settings';
+                }}
+            }}
+
             async function updatePreferences() {{
+                const preferences = {{
+                    theme: 'dark',
+                    notifications: false
+                }};
                 const response = await fetch('/api/update-preferences', {{
                     method: 'POST',
                     headers: {{ 'Content-Type': 'application/json' }},
-                    body: JSON.stringify({{
-                        theme: 'dark',
-                        notifications: false
-                    }})
+                    body: JSON.stringify(preferences)
                 }});
 
                 if (response.ok) {{
+                    // Apply locally: the event stream may be served by another worker, or be closed
+                    applyPatch({{ preferences: preferences }});
                     alert('Preferences updated!');
-                    window.location.reload();
                 }}
             }}
+
+            // Apply live updates pushed by the server (e.g. from another tab) instead of reloading
+            const events = new EventSource('/api/events');
+            events.addEventListener('patch', (event) => applyPatch(JSON.parse(event.data)));
         </script>
     </body>
     </html>
@@ -383,14 +456,14 @@ async def dashboard(request: Request):
     return HTMLResponse(content=html_content)
 
 @app.get("/profile", response_class=HTMLResponse)
-async def profile(request: Request):
-    user = get_current_user(request)
+async def profile(
+    request: Request,
+    user: Optional[dict] = Depends(optional_auth),
+    user_data: Optional[dict] = Depends(optional_user_data)
+):
     if not user:
         return RedirectResponse(url="/")
 
-    # Get user data from Firestore
-    user_data = FirebaseAuth.get_user_by_uid(user['uid'])
-
     html_content = f"""
     <!DOCTYPE html>
     <html lang="en">
@@ -478,6 +551,12 @@ async def profile(request: Request):
                 }}
             }}
 
+            // Fields with unsaved local edits are not overwritten by live updates
+            const edited = {{ name: false, preferences: false }};
+            document.getElementById('name').addEventListener('input', () => {{ edited.name = true; }});
+            document.getElementById('notifications').addEventListener('change', () => {{ edited.preferences = true; }});
+            document.getElementById('theme').addEventListener('change', () => {{ edited.preferences = true; }});
+
             async function updateProfile() {{
                 const name = document.getElementById('name').value;
                 const response = await fetch('/api/update-profile', {{
@@ -487,6 +566,7 @@ async def profile(request: Request):
                 }});
 
                 if (response.ok) {{
+                    edited.name = false;
                     alert('Profile updated successfully!');
                 }} else {{
                     alert('Failed to update profile');
@@ -507,11 +587,25 @@ async def profile(request: Request):
                 }});
 
                 if (response.ok) {{
+                    edited.preferences = false;
                     alert('Preferences updated successfully!');
                 }} else {{
                     alert('Failed to update preferences');
                 }}
             }}
+
+            // Apply live updates pushed by the server (e.g. from another tab)
+            const events = new EventSource('/api/events');
+            events.addEventListener('patch', (event) => {{
+                const patch = JSON.parse(event.data);
+                if ('name' in patch && !edited.name) {{
+                    document.getElementById('name').value = patch.name;
+                }}
+                if (patch.preferences && !edited.preferences) {{
+                    document.getElementById('notifications').checked = patch.preferences.notifications;
+                    document.getElementById('theme').value = patch.preferences.theme;
+                }}
+            }});
         </script>
     </body>
     </html>
@@ -520,18 +614,59 @@ async def profile(request: Request):
     return HTMLResponse(content=html_content)
 
 # 4. API Endpoints for User Data
-@app.post("/api/update-profile")
-async def update_profile(request: Request):
-    user = get_current_user(request)
-    if not user:
-        raise HTTPException(status_code=401, detail="Authentication required")
+class SubscriptionResponse(StreamingResponse):
+    """Streaming response that runs on_close however the response ends
+
+    The generator's finally never runs if sending fails before the first chunk,
+    and Starlette skips background tasks when the client disconnects mid-send.
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+@app.get("/api/events")
+async def user_events(request: Request, user: dict = Depends(require_auth)):
+    """Stream patches of changed user fields as server-sent events"""
+    uid = user['uid']
+    # Reserve the slot before responding so a full worker answers 503, not an empty stream
+    queue = broker.subscribe(uid)
+    if queue is None:
+        raise HTTPException(status_code=503, detail="Too many live connections")
+
+    async def event_stream():
+        while True:
+            try:
+                patch = await asyncio.wait_for(queue.get(), timeout=Config.SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing idle connections
+                yield ": keepalive\n\n"
+                if await request.is_disconnected():
+                    break
+                continue
+            yield format_sse(patch)
+
+    return SubscriptionResponse(
+        event_stream(),
+        on_close=lambda: broker.unsubscribe(uid, queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
+@app.post("/api/update-profile")
+async def update_profile(request: Request, user: dict = Depends(require_auth)):
     data = await request.json()
     name = data.get('name', '')
 
     user_data = {
         'name': name,
-        'updated_at': firestore.SERVER_TIMESTAMP
+        'updated_at': SERVER_TIMESTAMP
     }
 
     success = FirebaseAuth.create_or_update_user(user['uid'], user_data)
@@ -541,11 +676,7 @@ async def update_profile(request: Request):
         raise HTTPException(status_code=500, detail="Failed to update profile")
 
 @app.post("/api/update-preferences")
-async def update_preferences(request: Request):
-    user = get_current_user(request)
-    if not user:
-        raise HTTPException(status_code=401, detail="Authentication required")
-
+async def update_preferences(request: Request, user: dict = Depends(require_auth)):
     data = await request.json()
 
     user_data = {
@@ -553,7 +684,7 @@ async def update_preferences(request: Request):
             'theme': data.get('theme', 'light'),
             'notifications': data.get('notifications', True)
         },
-        'updated_at': firestore.SERVER_TIMESTAMP
+        'updated_at': SERVER_TIMESTAMP
     }
 
     success = FirebaseAuth.create_or_update_user(user['uid'], user_data)
@@ -562,6 +693,47 @@ async def update_preferences(request: Request):
     else:
         raise HTTPException(status_code=500, detail="Failed to update preferences")
 
+# 5. Admin Profiling (only registered when PROFILING_ENABLED is set)
+if Config.PROFILING_ENABLED:
+    from profiling import is_profiling_admin, sample_stacks, to_collapsed, to_speedscope
+
+    @app.get("/admin/profile")
+    async def sample_profile(seconds: float = 10, format: str = "collapsed", user: dict = Depends(require_auth)):
+        """Sample this worker's stacks for a few seconds"""
+        if not is_profiling_admin(user):
+            raise HTTPException(status_code=403, detail="Admin access required")
+        if not 0 < seconds <= Config.PROFILING_MAX_SECONDS or format not in ("collapsed", "speedscope"):
+            raise HTTPException(status_code=400, detail="Invalid profiling parameters")
+
+        interval = Config.PROFILING_SAMPLE_INTERVAL
+        # The sampler runs in the threadpool so the event loop keeps serving (and is sampled)
+        counts = await run_in_threadpool(sample_stacks, seconds, interval)
+        if format == "speedscope":
+            return to_speedscope(counts, interval, seconds)
+        return PlainTextResponse(to_collapsed(counts))
+
+    @app.get("/admin/profile/requests/{name}")
+    async def request_profile(name: str, user: dict = Depends(require_auth)):
+        """Download a cProfile dump written for a tagged request"""
+        if not is_profiling_admin(user):
+            raise HTTPException(status_code=403, detail="Admin access required")
+        path = os.path.join(Config.PROFILING_OUTPUT_DIR, os.path.basename(name))
+        if not name.endswith(".prof") or not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(name))
+
+# 6. Health Checks
+@app.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness(request: Request):
+    state = {"ready": request.app.state.ready, "warmup_seconds": request.app.state.warmup_seconds}
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=state)
+    return state
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
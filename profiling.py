@@ -0,0 +1,151 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from config import Config
+from typing import Callable, Dict, List, Optional
+
+# One tagged request is profiled at a time (on 3.12+ only one profiler can be active anyway)
+_request_profile_lock = threading.Lock()
+# From 3.12 cProfile hooks every thread via sys.monitoring; before that only the enabling one
+_PROFILER_SEES_ALL_THREADS = sys.version_info >= (3, 12)
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """Sample the stacks of every other thread; returns stack -> sample count"""
+    own_thread = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            counts[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+def to_collapsed(counts: Counter) -> str:
+    """Render samples in the collapsed-stack format used by flamegraph.pl"""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in counts.most_common())
+
+def to_speedscope(counts: Counter, interval: float, seconds: float) -> dict:
+    """Render samples as a speedscope sampled profile"""
+    frame_index: Dict[str, int] = {}
+    samples, weights = [], []
+    for stack, count in counts.items():
+        samples.append([frame_index.setdefault(name, len(frame_index)) for name in stack])
+        weights.append(count * interval)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": name} for name in frame_index]},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"{Config.APP_TITLE} worker {os.getpid()}",
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": seconds,
+            "samples": samples,
+            "weights": weights
+        }],
+        "exporter": Config.APP_TITLE
+    }
+
+def is_profiling_admin(user: dict) -> bool:
+    """Whether a user may use the profiling endpoints"""
+    return bool(user) and user.get('uid') in Config.PROFILING_ADMIN_UIDS
+
+class _RequestProfile:
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.threads: List[cProfile.Profile] = []
+
+    def dump(self, path: str):
+        stats = pstats.Stats(self.main)
+        for profiler in self.threads:
+            stats.add(profiler)
+        stats.dump_stats(path)
+
+_active_request_profile: ContextVar[Optional[_RequestProfile]] = ContextVar('active_request_profile', default=None)
+
+def profiled(func: Callable) -> Callable:
+    """Wrap a function about to go to the threadpool so a tagged request's profile covers it"""
+    profile = _active_request_profile.get()
+    if profile is None or _PROFILER_SEES_ALL_THREADS:
+        return func
+
+    def run(*args, **kwargs):
+        profiler = cProfile.Profile()
+        profile.threads.append(profiler)
+        return profiler.runcall(func, *args, **kwargs)
+    return run
+
+class RequestProfilerMiddleware:
+    """ASGI middleware: cProfile requests tagged with the profiling header
+
+    Added outside SessionMiddleware so cookie signing is included. The dump
+    is kept only if the memoized request user turns out to be a profiling
+    admin, which is known by the time the response starts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = Config.PROFILING_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.header, b"1") not in scope["headers"]:
+            await self.app(scope, receive, send)
+            return
+        if not _request_profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        # Shared with request.state, where the auth dependencies memoize the user
+        state = scope.setdefault("state", {})
+        name = f"{int(time.time() * 1000)}-{scope['method']}{scope['path'].replace('/', '_')}.prof"
+        keep = False
+
+        async def send_with_profile_header(message):
+            nonlocal keep
+            if message["type"] == "http.response.start":
+                keep = is_profiling_admin(state.get("user"))
+                if keep:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-file", name.encode())]}
+            await send(message)
+
+        profile = _RequestProfile()
+        token = _active_request_profile.set(profile)
+        try:
+            # Other requests served concurrently on the event loop thread show up too
+            profile.main.enable()
+            try:
+                await self.app(scope, receive, send_with_profile_header)
+            finally:
+                profile.main.disable()
+        finally:
+            _active_request_profile.reset(token)
+            _request_profile_lock.release()
+
+        if keep:
+            os.makedirs(Config.PROFILING_OUTPUT_DIR, exist_ok=True)
+            profile.dump(os.path.join(Config.PROFILING_OUTPUT_DIR, name))
+            prune_request_profiles(Config.PROFILING_OUTPUT_DIR, Config.PROFILING_MAX_FILES)
+
+def prune_request_profiles(directory: str, keep: int):
+    """Delete all but the newest `keep` request profiles"""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".prof")]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[keep:]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Error pruning request profiles: {e}")
@@ -0,0 +1,207 @@
+import json
+import re
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from config import Config
+from typing import Dict, Iterator, List, Optional
+
+class _ServerTimestamp:
+    """Backend-neutral stand-in for "the time the write is applied" """
+
+    def __repr__(self):
+        return "SERVER_TIMESTAMP"
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+class DocumentStore(ABC):
+    """Minimal document storage interface used by the app"""
+
+    @abstractmethod
+    def get(self, collection: str, doc_id: str) -> Optional[dict]:
+        """Return a document, or None if it does not exist"""
+
+    @abstractmethod
+    def set(self, collection: str, doc_id: str, data: dict, merge: bool = True):
+        """Write a document; with merge, nested maps are merged field by field"""
+
+    @abstractmethod
+    def get_many(self, collection: str, doc_ids: List[str]) -> Dict[str, Optional[dict]]:
+        """Return several documents at once, keyed by id (None when missing)"""
+
+    @abstractmethod
+    def stream(self, collection: str, order_by: Optional[str] = None,
+               descending: bool = False, limit: Optional[int] = None) -> Iterator[dict]:
+        """Iterate over documents, optionally ordered by a top-level field"""
+
+class FirestoreStore(DocumentStore):
+    """Cloud Firestore backend"""
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so importing the app never needs Firestore credentials
+        if self._client is None:
+            self._client = firestore.client()
+        return self._client
+
+    def get(self, collection: str, doc_id: str) -> Optional[dict]:
+        doc = self.client.collection(collection).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set(self, collection: str, doc_id: str, data: dict, merge: bool = True):
+        self.client.collection(collection).document(doc_id).set(_to_firestore(data), merge=merge)
+
+    def get_many(self, collection: str, doc_ids: List[str]) -> Dict[str, Optional[dict]]:
+        refs = [self.client.collection(collection).document(doc_id) for doc_id in doc_ids]
+        docs = {doc_id: None for doc_id in doc_ids}
+        for doc in self.client.get_all(refs):
+            if doc.exists:
+                docs[doc.id] = doc.to_dict()
+        return docs
+
+    def stream(self, collection: str, order_by: Optional[str] = None,
+               descending: bool = False, limit: Optional[int] = None) -> Iterator[dict]:
+        query = self.client.collection(collection)
+        if order_by:
+            direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+            query = query.order_by(order_by, direction=direction)
+        if limit is not None:
+            query = query.limit(limit)
+        for doc in query.stream():
+            yield doc.to_dict()
+
+def _to_firestore(value):
+    if value is SERVER_TIMESTAMP:
+        return firestore.SERVER_TIMESTAMP
+    if isinstance(value, dict):
+        return {key: _to_firestore(item) for key, item in value.items()}
+    return value
+
+class SQLiteStore(DocumentStore):
+    """Embedded backend: one JSON document per row in a WAL-mode SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (collection, id))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared across threads (the threadpool runs our calls)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, collection: str, doc_id: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        ).fetchone()
+        return _loads(row[0]) if row else None
+
+    def set(self, collection: str, doc_id: str, data: dict, merge: bool = True):
+        now = datetime.now(timezone.utc)
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front so the read-merge-write is atomic
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = None
+            if merge:
+                row = conn.execute(
+                    "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+                ).fetchone()
+                existing = _loads(row[0]) if row else None
+            document = _merge(existing or {}, data, now) if merge else _merge({}, data, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)",
+                (collection, doc_id, _dumps(document))
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_many(self, collection: str, doc_ids: List[str]) -> Dict[str, Optional[dict]]:
+        docs = {doc_id: None for doc_id in doc_ids}
+        if not doc_ids:
+            return docs
+        placeholders = ", ".join("?" for _ in doc_ids)
+        rows = self._connection().execute(
+            f"SELECT id, data FROM documents WHERE collection = ? AND id IN ({placeholders})",
+            (collection, *doc_ids)
+        ).fetchall()
+        for doc_id, data in rows:
+            docs[doc_id] = _loads(data)
+        return docs
+
+    def stream(self, collection: str, order_by: Optional[str] = None,
+               descending: bool = False, limit: Optional[int] = None) -> Iterator[dict]:
+        sql = "SELECT data FROM documents WHERE collection = ?"
+        if order_by:
+            if not _FIELD_NAME.match(order_by):
+                raise ValueError(f"Invalid order_by field: {order_by}")
+            # Timestamps are stored as tagged ISO-8601 strings, which sort chronologically
+            key = (f"COALESCE(json_extract(data, '$.{order_by}.__datetime__'), "
+                   f"json_extract(data, '$.{order_by}'))")
+            # Like Firestore, documents without the field are left out
+            sql += f" AND {key} IS NOT NULL ORDER BY {key} {'DESC' if descending else 'ASC'}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        for (data,) in self._connection().execute(sql, (collection,)).fetchall():
+            yield _loads(data)
+
+def _merge(existing: dict, data: dict, now: datetime) -> dict:
+    merged = dict(existing)
+    for key, value in data.items():
+        if value is SERVER_TIMESTAMP:
+            merged[key] = now
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value, now)
+        elif isinstance(value, dict):
+            merged[key] = _merge({}, value, now)
+        else:
+            merged[key] = value
+    return merged
+
+def _dumps(document: dict) -> str:
+    def encode(value):
+        if isinstance(value, datetime):
+            return {'__datetime__': value.astimezone(timezone.utc).isoformat(timespec='microseconds')}
+        raise TypeError(f"Unsupported value type: {type(value).__name__}")
+    return json.dumps(document, default=encode)
+
+def _loads(data: str) -> dict:
+    def decode(value):
+        if set(value) == {'__datetime__'}:
+            return datetime.fromisoformat(value['__datetime__'])
+        return value
+    return json.loads(data, object_hook=decode)
+
+_store: Optional[DocumentStore] = None
+
+def get_store() -> DocumentStore:
+    """Return the storage backend selected by Config.STORAGE_BACKEND"""
+    global _store
+    if _store is None:
+        storage_config = Config.get_storage_config()
+        if storage_config["backend"] == "firestore":
+            _store = FirestoreStore()
+        elif storage_config["backend"] == "sqlite":
+            _store = SQLiteStore(storage_config["sqlite_path"])
+        else:
+            raise ValueError(f"Unknown storage backend: {storage_config['backend']}")
+    return _store
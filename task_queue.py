@@ -0,0 +1,183 @@
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from starlette.concurrency import run_in_threadpool
+from firebase_config import FirebaseAuth
+from storage import SERVER_TIMESTAMP
+from config import Config
+from typing import List, Optional, Tuple
+
+# Tag for datetimes in the dead-letter file; older files may still hold the sentinel tag
+_DATETIME_TAG = "__datetime__"
+_SERVER_TIMESTAMP_TAG = {"__sentinel__": "server_timestamp"}
+
+def _encode(value, now: datetime):
+    # Resolve server timestamps now: a replay hours later must not become the login time
+    if value is SERVER_TIMESTAMP:
+        value = now
+    if isinstance(value, datetime):
+        return {_DATETIME_TAG: value.isoformat()}
+    if isinstance(value, dict):
+        return {key: _encode(item, now) for key, item in value.items()}
+    return value
+
+def _decode(value):
+    if value == _SERVER_TIMESTAMP_TAG:
+        return SERVER_TIMESTAMP
+    if isinstance(value, dict) and set(value) == {_DATETIME_TAG}:
+        return datetime.fromisoformat(value[_DATETIME_TAG])
+    if isinstance(value, dict):
+        return {key: _decode(item) for key, item in value.items()}
+    return value
+
+class BackgroundWriteQueue:
+    """Bounded in-process queue for Firestore writes nobody waits on"""
+
+    def __init__(self, max_size: int, workers: int, max_retries: int,
+                 retry_delay: float, put_timeout: float, dead_letter_path: str):
+        self.max_size = max_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.put_timeout = put_timeout
+        self.dead_letter_path = dead_letter_path
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._replay_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the workers and replay writes dead-lettered by a previous run"""
+        # Created here so the queue belongs to the server's event loop
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        claimed = self._claim_dead_letters()
+        if claimed:
+            self._replay_task = asyncio.create_task(self._replay(claimed))
+
+    async def submit(self, uid: str, user_data: dict):
+        """Queue a create_or_update_user call; blocks briefly when the queue is full"""
+        if self._queue is None:
+            await self._write_inline(uid, user_data)
+            return
+        try:
+            await asyncio.wait_for(self._queue.put((uid, user_data)), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            # Backpressure: the queue is saturated, so this caller pays for its own write
+            await self._write_inline(uid, user_data)
+
+    async def drain(self, timeout: float):
+        """Finish queued writes on shutdown; anything left over is dead-lettered"""
+        if self._queue is None:
+            return
+        pending = [self._queue.join()]
+        if self._replay_task is not None:
+            pending.append(self._replay_task)
+        try:
+            await asyncio.wait_for(asyncio.gather(*pending), timeout=timeout)
+        except asyncio.TimeoutError:
+            # An unfinished replay keeps its claimed files, so the next start picks them up
+            print(f"Background write queue did not drain within {timeout}s")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        while not self._queue.empty():
+            self._dead_letter(*self._queue.get_nowait())
+        self._queue = None
+        self._tasks = []
+        self._replay_task = None
+
+    async def _worker(self):
+        while True:
+            uid, user_data = await self._queue.get()
+            try:
+                await self._write_with_retries(uid, user_data)
+            except asyncio.CancelledError:
+                self._dead_letter(uid, user_data)
+                raise
+            finally:
+                self._queue.task_done()
+
+    async def _write_with_retries(self, uid: str, user_data: dict):
+        for attempt in range(self.max_retries + 1):
+            if await run_in_threadpool(FirebaseAuth.create_or_update_user, uid, user_data):
+                return
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.retry_delay * (2 ** attempt))
+        self._dead_letter(uid, user_data)
+
+    async def _write_inline(self, uid: str, user_data: dict):
+        if not await run_in_threadpool(FirebaseAuth.create_or_update_user, uid, user_data):
+            self._dead_letter(uid, user_data)
+
+    def _dead_letter(self, uid: str, user_data: dict):
+        try:
+            with open(self.dead_letter_path, 'a') as f:
+                record = {'uid': uid, 'user_data': _encode(user_data, datetime.now(timezone.utc))}
+                f.write(json.dumps(record, default=str) + '\n')
+        except Exception as e:
+            print(f"Error writing dead letter for {uid}: {e}")
+
+    def _claim_dead_letters(self) -> List[Tuple[str, int]]:
+        """Lock dead-letter files that no other worker is replaying; returns (path, fd) pairs"""
+        # Move fresh dead letters out of the append path under a unique name
+        try:
+            os.rename(self.dead_letter_path, f"{self.dead_letter_path}.{uuid.uuid4().hex}.replaying")
+        except FileNotFoundError:
+            pass
+        # Ownership is the flock, held until the replay ends or the process dies,
+        # so files left by a crashed run (even one with our PID) are picked up again
+        claimed = []
+        for path in sorted(glob.glob(glob.escape(self.dead_letter_path) + '.*.replaying')):
+            fd = _lock_file(path)
+            if fd is not None:
+                claimed.append((path, fd))
+        return claimed
+
+    async def _replay(self, claimed: List[Tuple[str, int]]):
+        """Re-run claimed dead letters; their files are only removed once every write has finished"""
+        try:
+            for path, fd in claimed:
+                try:
+                    with open(path) as f:
+                        jobs = [json.loads(line) for line in f if line.strip()]
+                except Exception as e:
+                    print(f"Error loading dead letters from {path}: {e}")
+                    continue
+                for record in jobs:
+                    await self.submit(record['uid'], _decode(record['user_data']))
+                # Each job has now either been written or dead-lettered again
+                await self._queue.join()
+                os.remove(path)
+        finally:
+            # Unfinished files stay on disk, unlocked, for the next start
+            for _, fd in claimed:
+                os.close(fd)
+
+def _lock_file(path: str) -> Optional[int]:
+    """Open and exclusively lock a claimed file; None if another worker holds it or it is gone"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The previous holder may have finished and removed it between our open and lock
+        if os.fstat(fd).st_ino != os.stat(path).st_ino:
+            raise FileNotFoundError(path)
+    except (BlockingIOError, FileNotFoundError):
+        os.close(fd)
+        return None
+    return fd
+
+write_queue = BackgroundWriteQueue(
+    max_size=Config.WRITE_QUEUE_MAX_SIZE,
+    workers=Config.WRITE_QUEUE_WORKERS,
+    max_retries=Config.WRITE_QUEUE_MAX_RETRIES,
+    retry_delay=Config.WRITE_QUEUE_RETRY_DELAY,
+    put_timeout=Config.WRITE_QUEUE_PUT_TIMEOUT,
+    dead_letter_path=Config.WRITE_QUEUE_DEAD_LETTER_PATH
+)
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+import pytest
+from storage import SERVER_TIMESTAMP, DocumentStore, SQLiteStore
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(str(tmp_path / "store.db"))
+
+def test_document_store_is_abstract():
+    with pytest.raises(TypeError):
+        DocumentStore()
+
+def test_get_missing_document(store):
+    assert store.get('users', 'nobody') is None
+
+def test_merge_set_merges_nested_maps(store):
+    store.set('users', 'alice', {'name': 'Alice', 'preferences': {'theme': 'light', 'notifications': True}})
+    store.set('users', 'alice', {'preferences': {'theme': 'dark'}, 'email': 'alice@example.com'})
+    assert store.get('users', 'alice') == {
+        'name': 'Alice',
+        'email': 'alice@example.com',
+        'preferences': {'theme': 'dark', 'notifications': True}
+    }
+
+def test_set_without_merge_replaces_document(store):
+    store.set('users', 'alice', {'name': 'Alice', 'preferences': {'theme': 'light'}})
+    store.set('users', 'alice', {'email': 'alice@example.com'}, merge=False)
+    assert store.get('users', 'alice') == {'email': 'alice@example.com'}
+
+def test_server_timestamp_top_level_and_nested(store):
+    before = datetime.now(timezone.utc)
+    store.set('users', 'alice', {'last_login': SERVER_TIMESTAMP, 'audit': {'updated_at': SERVER_TIMESTAMP}})
+    after = datetime.now(timezone.utc)
+    user = store.get('users', 'alice')
+    assert isinstance(user['last_login'], datetime)
+    assert before <= user['last_login'] <= after
+    assert user['audit']['updated_at'] == user['last_login']
+
+def test_get_many_reports_missing_documents(store):
+    store.set('users', 'alice', {'name': 'Alice'})
+    assert store.get_many('users', ['alice', 'nobody']) == {'alice': {'name': 'Alice'}, 'nobody': None}
+
+def test_stream_orders_limits_and_skips_documents_without_field(store):
+    for uid, hour in (('old', 1), ('newest', 3), ('middle', 2)):
+        store.set('users', uid, {'uid': uid, 'last_login': datetime(2026, 1, 1, hour, tzinfo=timezone.utc)})
+    store.set('users', 'never', {'uid': 'never'})
+    store.set('other', 'elsewhere', {'uid': 'elsewhere', 'last_login': datetime(2026, 1, 2, tzinfo=timezone.utc)})
+
+    recent = store.stream('users', order_by='last_login', descending=True, limit=2)
+    assert [user['uid'] for user in recent] == ['newest', 'middle']
+    everyone = store.stream('users', order_by='last_login', descending=True)
+    assert [user['uid'] for user in everyone] == ['newest', 'middle', 'old']
+
+def test_stream_rejects_unsafe_field_names(store):
+    with pytest.raises(ValueError):
+        list(store.stream('users', order_by="x'); DROP TABLE documents; --"))
@@ -0,0 +1,139 @@
+import asyncio
+import importlib
+import threading
+import time
+import httpx
+import pytest
+import auth_middleware
+import firebase_config
+import storage
+from cache import TTLCache, SingleFlight
+from config import Config
+from firebase_config import FirebaseAuth
+
+CONCURRENT_LOADS = 100
+
+class CountingStore(storage.DocumentStore):
+    """In-memory store that counts reads and keeps each read in flight for a while"""
+
+    def __init__(self, docs: dict, read_delay: float = 0.2):
+        self.docs = docs
+        self.read_delay = read_delay
+        self.reads = 0
+        # Set once a read has taken its snapshot
+        self.read_started = threading.Event()
+        # When set, reads hold their snapshot until it is released instead of sleeping
+        self.gate = None
+        self._lock = threading.Lock()
+
+    def get(self, collection, doc_id):
+        with self._lock:
+            self.reads += 1
+        snapshot = self.docs.get(doc_id)
+        gate = self.gate
+        self.read_started.set()
+        if gate is not None:
+            gate.wait(timeout=5)
+        else:
+            time.sleep(self.read_delay)
+        return dict(snapshot) if snapshot is not None else None
+
+    def set(self, collection, doc_id, data, merge=True):
+        self.docs[doc_id] = {**self.docs.get(doc_id, {}), **data} if merge else dict(data)
+
+    def get_many(self, collection, doc_ids):
+        return {doc_id: self.get(collection, doc_id) for doc_id in doc_ids}
+
+    def stream(self, collection, order_by=None, descending=False, limit=None):
+        return iter(list(self.docs.values())[:limit])
+
+@pytest.fixture
+def store(monkeypatch):
+    counting_store = CountingStore({'alice': {'uid': 'alice', 'name': 'Alice'}})
+    monkeypatch.setattr(storage, '_store', counting_store)
+    fresh_cache = TTLCache(ttl=Config.USER_CACHE_TTL, max_size=Config.USER_CACHE_MAX_SIZE)
+    monkeypatch.setattr(firebase_config, 'user_cache', fresh_cache)
+    monkeypatch.setattr(auth_middleware, 'user_cache', fresh_cache)
+    monkeypatch.setattr(firebase_config, 'user_reads', SingleFlight())
+    return counting_store
+
+@pytest.fixture
+def app(store, monkeypatch, tmp_path):
+    # main mounts ./static and reads the session secret at import time
+    (tmp_path / 'static').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, 'SECRET_KEY', 'test-secret')
+    return importlib.import_module('main').app
+
+def concurrent_lookups(uid: str) -> list:
+    results = [None] * CONCURRENT_LOADS
+    barrier = threading.Barrier(CONCURRENT_LOADS)
+
+    def lookup(i):
+        barrier.wait()
+        results[i] = FirebaseAuth.get_user_by_uid(uid)
+
+    threads = [threading.Thread(target=lookup, args=(i,)) for i in range(CONCURRENT_LOADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_lookups_of_existing_user_cost_one_read(store):
+    results = concurrent_lookups('alice')
+    assert store.reads == 1
+    assert all(result == {'uid': 'alice', 'name': 'Alice'} for result in results)
+
+def test_concurrent_lookups_of_missing_user_cost_one_read(store):
+    results = concurrent_lookups('ghost')
+    assert store.reads == 1
+    assert results == [None] * CONCURRENT_LOADS
+    # The miss is cached too
+    assert FirebaseAuth.get_user_by_uid('ghost') is None
+    assert store.reads == 1
+
+def test_concurrent_dashboard_loads_cost_one_read(app, store):
+    token = FirebaseAuth.create_access_token({'uid': 'alice', 'name': 'Alice'})['access_token']
+
+    async def load_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await asyncio.gather(*(
+                client.get('/dashboard', headers={'Authorization': f'Bearer {token}'})
+                for _ in range(CONCURRENT_LOADS)
+            ))
+
+    responses = asyncio.run(load_all())
+    assert store.reads == 1
+    assert all(response.status_code == 200 for response in responses)
+
+def test_read_racing_a_write_does_not_cache_old_document(store):
+    store.docs['alice'] = {'uid': 'alice', 'name': 'old'}
+    gate = store.gate = threading.Event()
+    reader = threading.Thread(target=FirebaseAuth.get_user_by_uid, args=('alice',))
+    reader.start()
+    assert store.read_started.wait(timeout=5)
+    store.gate = None
+    FirebaseAuth.create_or_update_user('alice', {'name': 'new'})
+    # Issued while the pre-write read is still in flight: must not join it
+    assert FirebaseAuth.get_user_by_uid('alice')['name'] == 'new'
+    gate.set()
+    reader.join()
+    assert FirebaseAuth.get_user_by_uid('alice')['name'] == 'new'
+
+def test_write_replaces_cached_miss(store):
+    assert FirebaseAuth.get_user_by_uid('bob') is None
+    FirebaseAuth.create_or_update_user('bob', {'uid': 'bob', 'name': 'Bob'})
+    assert FirebaseAuth.get_user_by_uid('bob') == {'uid': 'bob', 'name': 'Bob'}
+
+def test_cache_delete_records_stay_bounded_and_still_guard_fills():
+    cache = TTLCache(ttl=60, max_size=10)
+    stale = cache.version()
+    for i in range(1000):
+        cache.delete(f'user-{i}')
+    assert len(cache._deleted_at) <= 10
+    # Evicted delete records must not let a fill that predates them through
+    assert not cache.set('user-0', 'old', since=stale)
+    assert cache.set('user-0', 'new', since=cache.version())
+    assert cache.get('user-0') == 'new'